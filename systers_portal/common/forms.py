@@ -1,3 +1,5 @@
+import copy
+
 from django.core.exceptions import ImproperlyConfigured
 from django.forms import ModelForm
 
@@ -17,14 +19,34 @@ class ModelFormWithHelper(ModelForm):
         super(ModelFormWithHelper, self).__init__(*args, **kwargs)
 
         if hasattr(self.Meta, "helper_class"):
-            helper_class = getattr(self.Meta, "helper_class")
-            kwargs = self.get_helper_kwargs()
-            self.helper = helper_class(self, **kwargs)
+            self.helper = self.get_helper()
         else:
             raise ImproperlyConfigured(
                 "{0} is missing a 'helper_class' meta attribute.".format(
                     self.__class__.__name__))
 
+    def get_helper(self):
+        """Get a helper for the form. The helper is built once per form class and every form
+        instance gets a shallow copy of it pointing to that instance, so the layout is shared
+        instead of being rebuilt on each request. The layout is only read while rendering;
+        the mutable attrs and inputs are copied per instance.
+
+        :return: instance of the Meta helper_class
+        """
+        cls = type(self)
+        helper = cls.__dict__.get('_cached_helper')
+        if helper is None:
+            helper_class = getattr(self.Meta, "helper_class")
+            helper = helper_class(self, **self.get_helper_kwargs())
+            # Do not keep the first bound form (data, instance) alive through the cache
+            helper.form = None
+            cls._cached_helper = helper
+        helper = copy.copy(helper)
+        helper.form = self
+        helper.attrs = dict(helper.attrs)
+        helper.inputs = list(helper.inputs)
+        return helper
+
     def get_helper_kwargs(self):
         """Get all helper attributes from class Meta by stripping them of
         `helper_` part of attribute string
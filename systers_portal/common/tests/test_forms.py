@@ -37,3 +37,19 @@ class ModelFormWithHelperTestCase(TestCase):
 
         form = BarForm()
         self.assertEqual(form.helper.__class__, SubmitCancelFormHelper)
+
+    def test_model_form_helper_is_built_once(self):
+        """Test the helper layout is shared between instances of the same form class"""
+        class FooForm(ModelFormWithHelper):
+            class Meta:
+                model = User
+                fields = "__all__"
+                helper_class = SubmitCancelFormHelper
+
+        first_form = FooForm()
+        second_form = FooForm()
+        self.assertIsNot(first_form.helper, second_form.helper)
+        self.assertIs(first_form.helper.layout, second_form.helper.layout)
+        self.assertIs(first_form.helper.form, first_form)
+        self.assertIs(second_form.helper.form, second_form)
+        self.assertIsNone(FooForm._cached_helper.form)
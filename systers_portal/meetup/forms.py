@@ -1,4 +1,8 @@
+import hashlib
+import os
+
 from django import forms
+from django.db import transaction
 from django.utils import timezone
 
 from common.forms import ModelFormWithHelper
@@ -6,43 +10,101 @@ from common.helpers import SubmitCancelFormHelper
 from meetup.models import (Meetup, Rsvp, SupportRequest,
                            RequestMeetup)
 from multiupload.fields import MultiFileField
-from users.models import SystersUser
 from common.models import Comment
 
 from meetup.models import MeetupImages
 
-from meetup.utils import create_meetup
+from meetup.utils import (get_systers_user, get_systers_user_id, provision_zoom_meeting,
+                          sync_zoom_meeting)
 
-from meetup.utils import edit_meetup, get_meetup
+from users.scheduler import scheduler
 
 
-class RequestMeetupForm(ModelFormWithHelper):
-    """ Form to create a new Meetup Request. """
+# Widgets and cancel URLs shared by the meetup forms. Form fields deep copy their widget, so
+# the same instances are safe to reuse across all Meta classes.
+_DATEPICKER_WIDGET = forms.DateInput(attrs={'type': 'text', 'class': 'datepicker'})
+_TIMEPICKER_WIDGET = forms.TimeInput(attrs={'type': 'text', 'class': 'timepicker'})
+_DATETIME_WIDGETS = {'date': _DATEPICKER_WIDGET, 'time': _TIMEPICKER_WIDGET}
 
-    class Meta:
-        model = RequestMeetup
-        fields = ('title', 'slug', 'date', 'time', 'venue', 'meetup_location', 'description')
-        widgets = {'date': forms.DateInput(attrs={'type': 'text', 'class': 'datepicker'}),
-                   'time': forms.TimeInput(attrs={'type': 'text', 'class': 'timepicker'})}
-        helper_class = SubmitCancelFormHelper
-        helper_cancel_href = "{% url 'index' %}"
+_INDEX_CANCEL = "{% url 'index' %}"
+_VIEW_MEETUP_CANCEL = "{% url 'view_meetup' meetup.slug %}"
+_VIEW_SUPPORT_REQUEST_CANCEL = "{% url 'view_support_request' meetup.slug support_request.pk %}"
+
+_IMAGE_BATCH_SIZE = 20
+
+_PROVISION_ZOOM_JOB = "Provision Zoom meeting for {0}"
+_SYNC_ZOOM_JOB = "Sync Zoom meeting for {0}"
+
+
+def _create_images(meetup, images):
+    """Store uploaded images of a Meetup, inserting the rows in batches of _IMAGE_BATCH_SIZE.
+    The uploads are closed once stored, which also removes the temporary files of large ones."""
+    MeetupImages.objects.bulk_create([MeetupImages(image=img, meetup=meetup) for img in images],
+                                     batch_size=_IMAGE_BATCH_SIZE)
+    for img in images:
+        img.close()
 
-    def __init__(self, *args, **kwargs):
-        self.user = kwargs.pop('created_by')
-        super(RequestMeetupForm, self).__init__(*args, **kwargs)
+
+def _has_same_content(storage, name, upload):
+    """Check if the file stored under name has the same content as an uploaded file"""
+    try:
+        if storage.size(name) != upload.size:
+            return False
+        with storage.open(name) as stored:
+            stored_digest = hashlib.sha256()
+            for chunk in stored.chunks():
+                stored_digest.update(chunk)
+    except OSError:
+        return False
+    upload_digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        upload_digest.update(chunk)
+    return stored_digest.digest() == upload_digest.digest()
+
+
+def _schedule_zoom_job(job, meetup, name):
+    """Run a Zoom API job in the background once the Meetup row has been committed, so that
+    the request does not wait on the external API."""
+    transaction.on_commit(lambda: scheduler.add_job(job, "date", args=[meetup.pk],
+                                                    id=name.format(meetup.pk),
+                                                    replace_existing=True))
+
+
+class _SaveChangedFieldsMixin:
+    """Save an edited instance by updating only the model fields changed in the form, plus any
+    `always_updated_fields`. No UPDATE is issued when no model field was changed. Changed
+    many-to-many fields are saved through their own relation tables."""
+
+    always_updated_fields = ()
+
+    def get_changed_model_fields(self):
+        """Get the names of the changed form fields that are columns of the instance"""
+        columns = {field.name for field in self.instance._meta.concrete_fields}
+        return [name for name in self.changed_data if name in columns]
 
     def save(self, commit=True):
-        """Override save to add admin to the instance"""
-        instance = super(RequestMeetupForm, self).save(commit=False)
-        instance.created_by = SystersUser.objects.get(user=self.user)
+        instance = super(_SaveChangedFieldsMixin, self).save(commit=False)
         if commit:
-            instance.save()
+            changed_fields = self.get_changed_model_fields()
+            if changed_fields:
+                instance.save(update_fields=changed_fields + list(self.always_updated_fields))
+            self._save_m2m()
         return instance
 
+
+class _MeetupDateTimeCleanMixin:
+    """Validate that the date and time of a meetup are not in the past. The current local time
+    is computed once per validation cycle and shared by both field validators."""
+
+    def full_clean(self):
+        self._now = timezone.localtime()
+        self._today = self._now.date()
+        super(_MeetupDateTimeCleanMixin, self).full_clean()
+
     def clean_date(self):
         """Check if the date is less than the current date. If so, raise an error."""
         date = self.cleaned_data.get('date')
-        if date < timezone.now().date():
+        if date < self._today:
             raise forms.ValidationError("Date should not be before today's date.",
                                         code="date_in_past")
         return date
@@ -53,13 +115,46 @@ class RequestMeetupForm(ModelFormWithHelper):
         time = self.cleaned_data.get('time')
         date = self.cleaned_data.get('date')
         if time:
-            if date == timezone.now().date() and time < timezone.now().time():
+            if date == self._today and time < self._now.time():
                 raise forms.ValidationError("Time should not be a time that has already passed.",
                                             code="time_in_past")
         return time
 
 
-class AddMeetupForm(ModelFormWithHelper):
+class _BaseRequestMeetupForm(_MeetupDateTimeCleanMixin, ModelFormWithHelper):
+    """Base form to create a new Meetup Request. The created_by user is expected to be provided
+    when initializing the form. Subclasses may set `_extra_instance_defaults` to assign
+    additional attributes to the instance on save."""
+
+    _extra_instance_defaults = {}
+
+    def __init__(self, *args, **kwargs):
+        self.user = kwargs.pop('created_by')
+        super(_BaseRequestMeetupForm, self).__init__(*args, **kwargs)
+
+    def save(self, commit=True):
+        """Override save to add admin to the instance"""
+        instance = super(_BaseRequestMeetupForm, self).save(commit=False)
+        instance.created_by_id = get_systers_user_id(self.user)
+        for attr, value in self._extra_instance_defaults.items():
+            setattr(instance, attr, value)
+        if commit:
+            instance.save()
+        return instance
+
+
+class RequestMeetupForm(_BaseRequestMeetupForm):
+    """ Form to create a new Meetup Request. """
+
+    class Meta:
+        model = RequestMeetup
+        fields = ('title', 'slug', 'date', 'time', 'venue', 'meetup_location', 'description')
+        widgets = _DATETIME_WIDGETS
+        helper_class = SubmitCancelFormHelper
+        helper_cancel_href = _INDEX_CANCEL
+
+
+class AddMeetupForm(_MeetupDateTimeCleanMixin, ModelFormWithHelper):
     """Form to create new Meetup. The created_by and the meetup_location of which meetup belong to
     are expected to be provided when initializing the form:
 
@@ -71,10 +166,9 @@ class AddMeetupForm(ModelFormWithHelper):
         model = Meetup
         fields = ('title', 'slug', 'date', 'time', 'is_virtual', 'meetup_location',
                   'venue', 'description', 'resources')
-        widgets = {'date': forms.DateInput(attrs={'type': 'text', 'class': 'datepicker'}),
-                   'time': forms.TimeInput(attrs={'type': 'text', 'class': 'timepicker'})}
+        widgets = _DATETIME_WIDGETS
         helper_class = SubmitCancelFormHelper
-        helper_cancel_href = "{% url 'index' %}"
+        helper_cancel_href = _INDEX_CANCEL
 
     images = MultiFileField(required=False)
 
@@ -86,42 +180,23 @@ class AddMeetupForm(ModelFormWithHelper):
     def save(self, commit=True):
         """Override save to add created_by and meetup_location to the instance"""
         instance = super(AddMeetupForm, self).save(commit=False)
-        instance.created_by = SystersUser.objects.get(user=self.created_by)
-        instance.leader = SystersUser.objects.get(user=self.created_by)
-        if instance.is_virtual:
-            meet_data = create_meetup(instance)
-            instance.meet_link = meet_data['join_url']
-            instance.start_url = meet_data['start_url']
-            instance.meeting_id = meet_data['id']
+        systers_user = get_systers_user(self.created_by)
+        instance.created_by = systers_user
+        instance.leader = systers_user
         if commit:
             instance.save()
-        if self.cleaned_data['images']:
-            for img in self.cleaned_data['images']:
-                MeetupImages.objects.create(image=img, meetup=instance)
+            if instance.is_virtual:
+                _schedule_zoom_job(provision_zoom_meeting, instance, _PROVISION_ZOOM_JOB)
+            if self.cleaned_data['images']:
+                _create_images(instance, self.cleaned_data['images'])
         return instance
 
-    def clean_date(self):
-        """Check if the date is less than the current date. If so, raise an error."""
-        date = self.cleaned_data.get('date')
-        if date < timezone.now().date():
-            raise forms.ValidationError("Date should not be before today's date.")
-        return date
-
-    def clean_time(self):
-        """Check that if the date is the current date, the time is not the current time. If so,
-        raise an error."""
-        time = self.cleaned_data.get('time')
-        date = self.cleaned_data.get('date')
-        if time:
-            if date == timezone.now().date() and time < timezone.now().time():
-                raise forms.ValidationError("Time should not be a time that has already passed.")
-        return time
 
-
-class EditMeetupForm(ModelFormWithHelper):
+class EditMeetupForm(_SaveChangedFieldsMixin, ModelFormWithHelper):
     """Form to edit Meetup"""
 
     images = MultiFileField(required=False)
+    always_updated_fields = ('last_updated',)
 
     class Meta:
         model = Meetup
@@ -129,23 +204,48 @@ class EditMeetupForm(ModelFormWithHelper):
         widgets = {'date': forms.DateInput(attrs={'type': 'date', 'class': 'datepicker'}),
                    'time': forms.TimeInput(attrs={'type': 'time', 'class': 'timepicker'})}
         helper_class = SubmitCancelFormHelper
-        helper_cancel_href = "{% url 'view_meetup' meetup.slug %}"
+        helper_cancel_href = _VIEW_MEETUP_CANCEL
 
     def save(self, commit=True):
-        """Override save to add created_by and meetup_location to the instance"""
+        """Override save to replace the images of the instance. Only the edited columns are
+        written, so the Zoom links stored by the background sync job are never overwritten
+        with stale values."""
         instance = super(EditMeetupForm, self).save(commit)
-        MeetupImages.objects.filter(meetup=instance).delete()
-        if self.cleaned_data['images']:
-            for img in self.cleaned_data['images']:
-                MeetupImages.objects.create(image=img, meetup=instance)
-        if instance.is_virtual:
-            edit_meetup(instance)
-            meet_data = get_meetup(instance)
-            instance.meet_link = meet_data['join_url']
-            instance.start_url = meet_data['start_url']
-            instance.meeting_id = meet_data['id']
+        if commit:
+            self._replace_images(instance)
+            if instance.is_virtual and self.get_changed_model_fields():
+                if instance.meeting_id:
+                    _schedule_zoom_job(sync_zoom_meeting, instance, _SYNC_ZOOM_JOB)
+                else:
+                    # Not provisioned yet: (re)queue provisioning, replacing a pending job
+                    _schedule_zoom_job(provision_zoom_meeting, instance,
+                                       _PROVISION_ZOOM_JOB)
         return instance
 
+    @transaction.atomic
+    def _replace_images(self, instance):
+        """Make the images of the instance match the uploaded ones, deleting only the removed
+        images and inserting only the new ones. An upload is treated as an image already
+        stored only if both its file name and its content are the same."""
+        storage = MeetupImages._meta.get_field('image').storage
+        existing = {}
+        for pk, name in MeetupImages.objects.filter(meetup=instance).values_list('pk', 'image'):
+            existing.setdefault(os.path.basename(name), []).append((pk, name))
+        kept, new_images = set(), []
+        for img in self.cleaned_data['images'] or []:
+            candidates = existing.get(storage.get_valid_name(os.path.basename(img.name)), [])
+            match = next((pk for pk, name in candidates
+                          if pk not in kept and _has_same_content(storage, name, img)), None)
+            if match is None:
+                new_images.append(img)
+            else:
+                kept.add(match)
+                img.close()
+        removed = [pk for rows in existing.values() for pk, name in rows if pk not in kept]
+        if removed:
+            MeetupImages.objects.filter(pk__in=removed).delete()
+        _create_images(instance, new_images)
+
 
 class AddMeetupCommentForm(ModelFormWithHelper):
     """Form to add a comment to a Meetup"""
@@ -154,7 +254,7 @@ class AddMeetupCommentForm(ModelFormWithHelper):
         model = Comment
         fields = ('body',)
         helper_class = SubmitCancelFormHelper
-        helper_cancel_href = "{% url 'view_meetup' meetup.slug %}"
+        helper_cancel_href = _VIEW_MEETUP_CANCEL
 
     def __init__(self, *args, **kwargs):
         self.content_object = kwargs.pop('content_object')
@@ -165,20 +265,20 @@ class AddMeetupCommentForm(ModelFormWithHelper):
         """Override save to add content_object and author to the instance"""
         instance = super(AddMeetupCommentForm, self).save(commit=False)
         instance.content_object = self.content_object
-        instance.author = SystersUser.objects.get(user=self.author)
+        instance.author_id = get_systers_user_id(self.author)
         if commit:
             instance.save()
         return instance
 
 
-class EditMeetupCommentForm(ModelFormWithHelper):
+class EditMeetupCommentForm(_SaveChangedFieldsMixin, ModelFormWithHelper):
     """Form to edit a comment for a Meetup"""
 
     class Meta:
         model = Comment
         fields = ('body',)
         helper_class = SubmitCancelFormHelper
-        helper_cancel_href = "{% url 'view_meetup' meetup.slug %}"
+        helper_cancel_href = _VIEW_MEETUP_CANCEL
 
 
 class RsvpForm(ModelFormWithHelper):
@@ -188,7 +288,7 @@ class RsvpForm(ModelFormWithHelper):
         model = Rsvp
         fields = ('coming', 'plus_one')
         helper_class = SubmitCancelFormHelper
-        helper_cancel_href = "{% url 'view_meetup'  meetup.slug %}"
+        helper_cancel_href = _VIEW_MEETUP_CANCEL
 
     def __init__(self, *args, **kwargs):
         self.user = kwargs.pop('user')
@@ -198,7 +298,7 @@ class RsvpForm(ModelFormWithHelper):
     def save(self, commit=True):
         """Override save to add user and meetup to the instance"""
         instance = super(RsvpForm, self).save(commit=False)
-        instance.user = SystersUser.objects.get(user=self.user)
+        instance.user_id = get_systers_user_id(self.user)
         instance.meetup = self.meetup
         if commit:
             instance.save()
@@ -212,7 +312,7 @@ class AddSupportRequestForm(ModelFormWithHelper):
         model = SupportRequest
         fields = ('description',)
         helper_class = SubmitCancelFormHelper
-        helper_cancel_href = "{% url 'view_meetup' meetup.slug %}"
+        helper_cancel_href = _VIEW_MEETUP_CANCEL
 
     def __init__(self, *args, **kwargs):
         self.volunteer = kwargs.pop('volunteer')
@@ -223,21 +323,21 @@ class AddSupportRequestForm(ModelFormWithHelper):
         """Override save to add volunteer and meetup to the instance. Also, send notification to
          all organizers."""
         instance = super(AddSupportRequestForm, self).save(commit=False)
-        instance.volunteer = SystersUser.objects.get(user=self.volunteer)
+        instance.volunteer_id = get_systers_user_id(self.volunteer)
         instance.meetup = self.meetup
         if commit:
             instance.save()
         return instance
 
 
-class EditSupportRequestForm(ModelFormWithHelper):
+class EditSupportRequestForm(_SaveChangedFieldsMixin, ModelFormWithHelper):
     """Form to edit a Support Request"""
 
     class Meta:
         model = SupportRequest
         fields = ('description',)
         helper_class = SubmitCancelFormHelper
-        helper_cancel_href = "{% url 'view_meetup' meetup.slug %}"
+        helper_cancel_href = _VIEW_MEETUP_CANCEL
 
 
 class AddSupportRequestCommentForm(ModelFormWithHelper):
@@ -247,8 +347,7 @@ class AddSupportRequestCommentForm(ModelFormWithHelper):
         model = Comment
         fields = ('body',)
         helper_class = SubmitCancelFormHelper
-        helper_cancel_href = "{% url 'view_support_request' meetup.slug" \
-                             " support_request.pk %}"
+        helper_cancel_href = _VIEW_SUPPORT_REQUEST_CANCEL
 
     def __init__(self, *args, **kwargs):
         self.content_object = kwargs.pop('content_object')
@@ -259,21 +358,20 @@ class AddSupportRequestCommentForm(ModelFormWithHelper):
         """Override save to add content_object and author to the instance"""
         instance = super(AddSupportRequestCommentForm, self).save(commit=False)
         instance.content_object = self.content_object
-        instance.author = SystersUser.objects.get(user=self.author)
+        instance.author_id = get_systers_user_id(self.author)
         if commit:
             instance.save()
         return instance
 
 
-class EditSupportRequestCommentForm(ModelFormWithHelper):
+class EditSupportRequestCommentForm(_SaveChangedFieldsMixin, ModelFormWithHelper):
     """Form to edit a comment for a Support Request"""
 
     class Meta:
         model = Comment
         fields = ('body',)
         helper_class = SubmitCancelFormHelper
-        helper_cancel_href = "{% url 'view_support_request' meetup.slug" \
-                             " support_request.pk %}"
+        helper_cancel_href = _VIEW_SUPPORT_REQUEST_CANCEL
 
 
 class PastMeetup(ModelFormWithHelper):
@@ -283,56 +381,24 @@ class PastMeetup(ModelFormWithHelper):
         model = Meetup
         fields = ('resources',)
         helper_class = SubmitCancelFormHelper
-        helper_cancel_href = "{% url 'view_meetup' meetup.slug %}"
+        helper_cancel_href = _VIEW_MEETUP_CANCEL
 
     def save(self, commit=True):
         """Override save to add images to the instance"""
         instance = super(PastMeetup, self).save(commit)
         if self.cleaned_data['images']:
-            for img in self.cleaned_data['images']:
-                MeetupImages.objects.create(image=img, meetup=instance)
+            _create_images(instance, self.cleaned_data['images'])
         return instance
 
 
-class RequestVirtualMeetupForm(ModelFormWithHelper):
-    """ Form to create a new Meetup Request. """
+class RequestVirtualMeetupForm(_BaseRequestMeetupForm):
+    """ Form to create a new virtual Meetup Request. """
+
+    _extra_instance_defaults = {'is_virtual': True}
 
     class Meta:
         model = RequestMeetup
         fields = ('title', 'slug', 'date', 'time', 'description')
-        widgets = {'date': forms.DateInput(attrs={'type': 'text', 'class': 'datepicker'}),
-                   'time': forms.TimeInput(attrs={'type': 'text', 'class': 'timepicker'})}
+        widgets = _DATETIME_WIDGETS
         helper_class = SubmitCancelFormHelper
-        helper_cancel_href = "{% url 'index' %}"
-
-    def __init__(self, *args, **kwargs):
-        self.user = kwargs.pop('created_by')
-        super(RequestVirtualMeetupForm, self).__init__(*args, **kwargs)
-
-    def save(self, commit=True):
-        """Override save to add admin to the instance"""
-        instance = super(RequestVirtualMeetupForm, self).save(commit=False)
-        instance.created_by = SystersUser.objects.get(user=self.user)
-        instance.is_virtual = True
-        if commit:
-            instance.save()
-        return instance
-
-    def clean_date(self):
-        """Check if the date is less than the current date. If so, raise an error."""
-        date = self.cleaned_data.get('date')
-        if date < timezone.now().date():
-            raise forms.ValidationError("Date should not be before today's date.",
-                                        code="date_in_past")
-        return date
-
-    def clean_time(self):
-        """Check that if the date is the current date, the time is not the current time. If so,
-        raise an error."""
-        time = self.cleaned_data.get('time')
-        date = self.cleaned_data.get('date')
-        if time:
-            if date == timezone.now().date() and time < timezone.now().time():
-                raise forms.ValidationError("Time should not be a time that has already passed.",
-                                            code="time_in_past")
-        return time
+        helper_cancel_href = _INDEX_CANCEL
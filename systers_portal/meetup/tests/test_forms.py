@@ -1,25 +1,39 @@
-from django.contrib.auth.models import User
-from django.test import TestCase
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from django.contrib.auth.models import Group, Permission, User
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.utils import timezone
 from django.utils.timezone import timedelta
 from cities_light.models import City, Country
 from django.contrib.contenttypes.models import ContentType
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils.datastructures import MultiValueDict
 
 
-from meetup.forms import (AddMeetupForm, EditMeetupForm,
+from common.forms import ModelFormWithHelper
+from common.helpers import SubmitCancelFormHelper
+from meetup.forms import (_SaveChangedFieldsMixin, AddMeetupForm, EditMeetupForm,
                           AddMeetupCommentForm, EditMeetupCommentForm,
                           RsvpForm, AddSupportRequestForm,
                           EditSupportRequestForm, AddSupportRequestCommentForm,
                           EditSupportRequestCommentForm,
-                          RequestMeetupForm)
+                          RequestMeetupForm, RequestVirtualMeetupForm, PastMeetup)
 from meetup.models import (Meetup, Rsvp, SupportRequest,
-                           RequestMeetup)
+                           RequestMeetup, MeetupImages)
+from meetup.utils import provision_zoom_meeting, sync_zoom_meeting
 from users.models import SystersUser
 from common.models import Comment
 
 
 class MeetupFormTestCaseBase:
     def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_override = override_settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        self.addCleanup(media_override.disable)
         self.user = User.objects.create_user(username='foo', password='foobar',
                                              email='user@test.com')
         self.systers_user = SystersUser.objects.get(user=self.user)
@@ -79,6 +93,21 @@ class RequestMeetupFormTestCase(MeetupFormTestCaseBase, TestCase):
                         ["Time should not be a time that has already passed."])
 
 
+class RequestVirtualMeetupFormTestCase(MeetupFormTestCaseBase, TestCase):
+    def test_request_virtual_meetup_form(self):
+        """Test request virtual Meetup form"""
+        date = (timezone.now() + timedelta(2)).date()
+        time = timezone.now().time()
+        data = {'title': 'Foo', 'slug': 'foo', 'date': date, 'time': time,
+                'description': "It's a test meetup."}
+        form = RequestVirtualMeetupForm(data=data, created_by=self.user)
+        self.assertTrue(form.is_valid())
+        form.save()
+        new_meetup_request = RequestMeetup.objects.get(slug='foo')
+        self.assertEqual(new_meetup_request.created_by, self.systers_user)
+        self.assertTrue(new_meetup_request.is_virtual)
+
+
 class AddMeetupFormTestCase(MeetupFormTestCaseBase, TestCase):
     def setUp(self):
         super(AddMeetupFormTestCase, self).setUp()
@@ -108,6 +137,20 @@ class AddMeetupFormTestCase(MeetupFormTestCaseBase, TestCase):
         self.assertTrue(new_meetup.created_by, self.systers_user)
         self.assertTrue(new_meetup.meetup_location, self.location)
 
+    def test_add_meetup_form_with_images(self):
+        """Test add Meetup form stores the uploaded images"""
+        date = (timezone.now() + timedelta(2)).date()
+        data = {'title': 'Foo', 'slug': 'foo', 'date': date, 'time': timezone.now().time(),
+                'meetup_location': self.location.id,
+                'description': "It's a test meetup."}
+        files = MultiValueDict({'images': [SimpleUploadedFile('first.jpg', b'first'),
+                                           SimpleUploadedFile('second.jpg', b'second')]})
+        form = AddMeetupForm(data=data, files=files, created_by=self.user,
+                             leader=self.systers_user)
+        self.assertTrue(form.is_valid())
+        meetup = form.save()
+        self.assertEqual(MeetupImages.objects.filter(meetup=meetup).count(), 2)
+
     def test_add_meetup_form_with_past_date(self):
         """Test add Meetup form with a date that has passed."""
         date = (timezone.now() - timedelta(2)).date()
@@ -153,6 +196,108 @@ class EditMeetupFormTestCase(MeetupFormTestCaseBase, TestCase):
         self.assertEqual(meetup.created_by, self.systers_user)
         self.assertEqual(meetup.meetup_location, self.location)
 
+    def edit_meetup_images(self, uploads):
+        date = (timezone.now() + timedelta(2)).date()
+        data = {'slug': 'foobar', 'title': 'Foo Bar', 'date': date,
+                'time': timezone.now().time(), 'description': "It's a test meetup.",
+                'venue': 'test address'}
+        form = EditMeetupForm(instance=self.meetup, data=data,
+                              files=MultiValueDict({'images': uploads}))
+        self.assertTrue(form.is_valid())
+        form.save()
+        return MeetupImages.objects.filter(meetup=self.meetup)
+
+    def test_edit_meetup_form_keeps_unchanged_images(self):
+        """Test edit meetup only deletes the images that were not uploaded again"""
+        kept = MeetupImages.objects.create(image=SimpleUploadedFile('kept.jpg', b'kept'),
+                                           meetup=self.meetup)
+        MeetupImages.objects.create(image=SimpleUploadedFile('removed.jpg', b'removed'),
+                                    meetup=self.meetup)
+        images = self.edit_meetup_images([SimpleUploadedFile('kept.jpg', b'kept')])
+        self.assertQuerysetEqual(images, [kept.pk], transform=lambda image: image.pk)
+
+    def test_edit_meetup_form_replaces_changed_image(self):
+        """Test edit meetup stores a re-uploaded image whose content changed"""
+        old = MeetupImages.objects.create(image=SimpleUploadedFile('banner.jpg', b'old'),
+                                          meetup=self.meetup)
+        images = self.edit_meetup_images([SimpleUploadedFile('banner.jpg', b'new')])
+        self.assertEqual(len(images), 1)
+        self.assertNotEqual(images[0].pk, old.pk)
+        self.assertEqual(images[0].image.read(), b'new')
+
+    def test_edit_meetup_form_with_same_named_uploads(self):
+        """Test edit meetup stores every upload even if they share a file name"""
+        images = self.edit_meetup_images([SimpleUploadedFile('image.jpg', b'first'),
+                                          SimpleUploadedFile('image.jpg', b'second')])
+        self.assertCountEqual([image.image.read() for image in images], [b'first', b'second'])
+
+
+@patch('meetup.forms.scheduler')
+class ZoomJobSchedulingTestCase(MeetupFormTestCaseBase, TransactionTestCase):
+    """Zoom jobs are queued with transaction.on_commit, which only runs outside of the
+    transaction wrapping every TestCase."""
+
+    def meetup_data(self, **kwargs):
+        data = {'title': 'Foo', 'slug': 'foo', 'date': (timezone.now() + timedelta(2)).date(),
+                'time': timezone.now().time(), 'meetup_location': self.location.id,
+                'description': "It's a test meetup."}
+        data.update(kwargs)
+        return data
+
+    def assert_job_scheduled(self, scheduler, job, meetup):
+        scheduler.add_job.assert_called_once()
+        args, kwargs = scheduler.add_job.call_args
+        self.assertEqual(args[0], job)
+        self.assertEqual(kwargs['args'], [meetup.pk])
+
+    def test_add_virtual_meetup_schedules_provisioning(self, scheduler):
+        form = AddMeetupForm(data=self.meetup_data(is_virtual=True), created_by=self.user,
+                             leader=self.systers_user)
+        self.assertTrue(form.is_valid())
+        meetup = form.save()
+        self.assert_job_scheduled(scheduler, provision_zoom_meeting, meetup)
+
+    def test_add_meetup_does_not_schedule_job(self, scheduler):
+        form = AddMeetupForm(data=self.meetup_data(), created_by=self.user,
+                             leader=self.systers_user)
+        self.assertTrue(form.is_valid())
+        form.save()
+        scheduler.add_job.assert_not_called()
+
+    def test_edit_virtual_meetup_schedules_sync(self, scheduler):
+        Meetup.objects.filter(pk=self.meetup.pk).update(is_virtual=True, meeting_id='1')
+        meetup = Meetup.objects.get(pk=self.meetup.pk)
+        form = EditMeetupForm(instance=meetup, data=self.meetup_data(venue='test address'))
+        self.assertTrue(form.is_valid())
+        form.save()
+        self.assert_job_scheduled(scheduler, sync_zoom_meeting, meetup)
+
+    def test_edit_unprovisioned_virtual_meetup_schedules_provisioning(self, scheduler):
+        Meetup.objects.filter(pk=self.meetup.pk).update(is_virtual=True)
+        meetup = Meetup.objects.get(pk=self.meetup.pk)
+        form = EditMeetupForm(instance=meetup, data=self.meetup_data(venue='test address'))
+        self.assertTrue(form.is_valid())
+        form.save()
+        self.assert_job_scheduled(scheduler, provision_zoom_meeting, meetup)
+
+    def test_edit_meetup_does_not_schedule_job(self, scheduler):
+        form = EditMeetupForm(instance=self.meetup, data=self.meetup_data(venue='test address'))
+        self.assertTrue(form.is_valid())
+        form.save()
+        scheduler.add_job.assert_not_called()
+
+
+class PastMeetupFormTestCase(MeetupFormTestCaseBase, TestCase):
+    def test_past_meetup_form(self):
+        """Test past Meetup form stores the uploaded images and closes the uploads"""
+        upload = SimpleUploadedFile('photo.jpg', b'image')
+        form = PastMeetup(instance=self.meetup, data={'resources': 'Slides'},
+                          files=MultiValueDict({'images': [upload]}))
+        self.assertTrue(form.is_valid())
+        form.save()
+        self.assertEqual(MeetupImages.objects.filter(meetup=self.meetup).count(), 1)
+        self.assertTrue(upload.closed)
+
 
 class AddMeetupCommentFormTestCase(MeetupFormTestCaseBase, TestCase):
     def test_add_meetup_comment_form(self):
@@ -206,6 +351,15 @@ class RsvpFormTestCase(MeetupFormTestCaseBase, TestCase):
         self.assertEqual(rsvp_list[0].user, self.systers_user)
         self.assertEqual(rsvp_list[0].meetup, self.meetup)
 
+    def test_rsvp_form_reuses_cached_systers_user(self):
+        """Test Rsvp form does not refetch an already loaded SystersUser"""
+        self.assertEqual(self.user.systersuser, self.systers_user)
+        data = {'coming': True, 'plus_one': False}
+        form = RsvpForm(data=data, user=self.user, meetup=self.meetup)
+        self.assertTrue(form.is_valid())
+        with self.assertNumQueries(1):
+            form.save()
+
 
 class AddSupportRequestFormTestCase(MeetupFormTestCaseBase, TestCase):
     def test_add_support_request_form(self):
@@ -241,6 +395,14 @@ class EditSupportRequestFormTestCase(MeetupFormTestCaseBase, TestCase):
         self.assertEqual(support_requests[0].volunteer, self.systers_user)
         self.assertEqual(support_requests[0].meetup, self.meetup)
 
+    def test_edit_support_request_form_without_changes(self):
+        """Test edit Support Request form does not update the instance when nothing changed"""
+        data = {'description': 'This is a test description'}
+        form = EditSupportRequestForm(instance=self.support_request, data=data)
+        self.assertTrue(form.is_valid())
+        with self.assertNumQueries(0):
+            form.save()
+
 
 class AddSupportRequestCommentFormTestCase(MeetupFormTestCaseBase, TestCase):
     def setUp(self):
@@ -287,3 +449,51 @@ class EditSupportRequestCommentFormTestCase(MeetupFormTestCaseBase, TestCase):
         self.assertEqual(comments[0].body, 'This is an edited test comment')
         self.assertEqual(comments[0].author, self.systers_user)
         self.assertEqual(comments[0].content_object, self.support_request)
+
+
+class SaveChangedFieldsMixinTestCase(TestCase):
+    class GroupForm(_SaveChangedFieldsMixin, ModelFormWithHelper):
+        class Meta:
+            model = Group
+            fields = ('name', 'permissions')
+            helper_class = SubmitCancelFormHelper
+
+    def setUp(self):
+        self.group = Group.objects.create(name='Foo')
+        self.permission = Permission.objects.first()
+
+    def test_save_changed_fields_with_many_to_many(self):
+        """Test changed columns and many-to-many fields are both saved"""
+        form = self.GroupForm(instance=self.group,
+                              data={'name': 'Bar', 'permissions': [self.permission.pk]})
+        self.assertTrue(form.is_valid())
+        form.save()
+        group = Group.objects.get(pk=self.group.pk)
+        self.assertEqual(group.name, 'Bar')
+        self.assertEqual(list(group.permissions.all()), [self.permission])
+
+    def test_save_only_many_to_many_changed(self):
+        """Test a many-to-many change is saved even when no column changed"""
+        form = self.GroupForm(instance=self.group,
+                              data={'name': 'Foo', 'permissions': [self.permission.pk]})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.get_changed_model_fields(), [])
+        form.save()
+        self.assertEqual(list(self.group.permissions.all()), [self.permission])
+
+    def test_save_changed_fields_with_all_fields(self):
+        """Test the mixin works on a form declaring all model fields"""
+        class AllFieldsGroupForm(_SaveChangedFieldsMixin, ModelFormWithHelper):
+            class Meta:
+                model = Group
+                fields = '__all__'
+                helper_class = SubmitCancelFormHelper
+
+        form = AllFieldsGroupForm(instance=self.group,
+                                  data={'name': 'Bar', 'permissions': [self.permission.pk]})
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.get_changed_model_fields(), ['name'])
+        form.save()
+        group = Group.objects.get(pk=self.group.pk)
+        self.assertEqual(group.name, 'Bar')
+        self.assertEqual(list(group.permissions.all()), [self.permission])
@@ -1,3 +1,5 @@
+from unittest.mock import patch
+
 from django.test import TestCase
 from django.contrib.auth.models import Group, User
 from guardian.shortcuts import get_perms
@@ -6,7 +8,9 @@ from cities_light.models import City, Country
 from django.utils import timezone
 from meetup.models import Meetup
 from meetup.permissions import groups_templates, group_permissions
-from meetup.utils import (create_groups, assign_permissions, remove_groups)
+from meetup.utils import (create_groups, assign_permissions, remove_groups,
+                          get_systers_user, get_systers_user_id, provision_zoom_meeting,
+                          sync_zoom_meeting)
 from users.models import SystersUser
 
 
@@ -59,3 +63,84 @@ class UtilsTestCase(TestCase):
                            list(group.permissions.all())]
             group_perms += get_perms(group, meetup)
             self.assertCountEqual(group_perms, value)
+
+    def test_get_systers_user(self):
+        """Test that the SystersUser of a User is fetched once and then cached"""
+        user = User.objects.create_user(username='foo', password='foobar')
+        user = User.objects.get(pk=user.pk)
+        with self.assertNumQueries(1):
+            systers_user = get_systers_user(user)
+            self.assertEqual(get_systers_user(user), systers_user)
+        self.assertEqual(systers_user, SystersUser.objects.get(user=user))
+
+    def test_get_systers_user_id(self):
+        """Test getting the primary key of the SystersUser of a User"""
+        user = User.objects.create_user(username='foo', password='foobar')
+        systers_user = SystersUser.objects.get(user=user)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_systers_user_id(user), systers_user.pk)
+        user = User.objects.get(pk=user.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_systers_user_id(user), systers_user.pk)
+
+
+class ZoomJobsTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='foo', password='foobar')
+        systers_user = SystersUser.objects.get(user=user)
+        self.meetup = Meetup.objects.create(title='Foo Bar Baz', slug='foo-bar-baz',
+                                            date=timezone.now().date(),
+                                            time=timezone.now().time(),
+                                            description='This is test Meetup',
+                                            created_by=systers_user,
+                                            leader=systers_user,
+                                            is_virtual=True)
+        self.meet_data = {'join_url': 'https://zoom.us/j/1', 'start_url': 'https://zoom.us/s/1',
+                          'id': '1'}
+
+    def assert_zoom_links_stored(self):
+        meetup = Meetup.objects.get(pk=self.meetup.pk)
+        self.assertEqual(meetup.meet_link, 'https://zoom.us/j/1')
+        self.assertEqual(meetup.start_url, 'https://zoom.us/s/1')
+        self.assertEqual(meetup.meeting_id, '1')
+
+    @patch('meetup.utils.create_meetup')
+    def test_provision_zoom_meeting(self, create_meetup):
+        """Test the created Zoom meeting links are stored with a single UPDATE"""
+        create_meetup.return_value = self.meet_data
+        with self.assertNumQueries(2):
+            provision_zoom_meeting(self.meetup.pk)
+        self.assert_zoom_links_stored()
+
+    @patch('meetup.utils.create_meetup')
+    def test_provision_zoom_meeting_failure(self, create_meetup):
+        """Test a Zoom error response is logged and leaves the Meetup untouched"""
+        create_meetup.return_value = {'code': 124, 'message': 'Invalid access token.'}
+        with self.assertLogs('meetup.utils', level='ERROR'):
+            provision_zoom_meeting(self.meetup.pk)
+        self.assertIsNone(Meetup.objects.get(pk=self.meetup.pk).meet_link)
+
+    @patch('meetup.utils.get_meetup')
+    @patch('meetup.utils.edit_meetup')
+    def test_sync_zoom_meeting(self, edit_meetup, get_meetup):
+        """Test the edited Zoom meeting links are stored without refetching the meeting"""
+        edit_meetup.return_value = self.meet_data
+        sync_zoom_meeting(self.meetup.pk)
+        get_meetup.assert_not_called()
+        self.assert_zoom_links_stored()
+
+    @patch('meetup.utils.get_meetup')
+    @patch('meetup.utils.edit_meetup')
+    def test_sync_zoom_meeting_with_empty_response(self, edit_meetup, get_meetup):
+        """Test the Zoom meeting is fetched when the edit response has no body"""
+        edit_meetup.return_value = {}
+        get_meetup.return_value = self.meet_data
+        sync_zoom_meeting(self.meetup.pk)
+        self.assert_zoom_links_stored()
+
+    @patch('meetup.utils.edit_meetup')
+    def test_sync_zoom_meeting_failure(self, edit_meetup):
+        """Test a failing Zoom connection is logged"""
+        edit_meetup.side_effect = OSError
+        with self.assertLogs('meetup.utils', level='ERROR'):
+            sync_zoom_meeting(self.meetup.pk)
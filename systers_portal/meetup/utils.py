@@ -1,23 +1,52 @@
-from django.contrib.auth.models import Group, Permission
+from django.contrib.auth.models import Group, Permission, User
 from django.core.mail import send_mail
 from django.db import transaction
 from django.template.loader import render_to_string
 
 from meetup.permissions import groups_templates, group_permissions
 
-from meetup.models import Rsvp
+from meetup.models import Meetup, Rsvp
 
-from users.models import UserSetting
+from users.models import SystersUser, UserSetting
 
 from systers_portal.settings.dev import FROM_EMAIL
 import http.client
 import jwt
 import datetime
 import json
+import logging
 
 from systers_portal.settings.base import ZOOM_API_KEY,\
     ZOOM_API_SECRET, ZOOM_USER_ID
 
+logger = logging.getLogger(__name__)
+
+# Errors raised by the Zoom API helpers: connection failures, HTTP protocol errors, invalid
+# JSON (ValueError) and error payloads missing the meeting links (KeyError)
+ZOOM_ERRORS = (OSError, http.client.HTTPException, ValueError, KeyError)
+
+
+def get_systers_user(user):
+    """Get the SystersUser of a User. The reverse one-to-one accessor caches the result on the
+    User instance, so for request.user only the first lookup of a request hits the database.
+
+    :param user: User instance
+    :return: SystersUser instance
+    """
+    return getattr(user, 'systersuser', None) or SystersUser.objects.get(user=user)
+
+
+def get_systers_user_id(user):
+    """Get the primary key of the SystersUser of a User. A SystersUser already cached on the
+    User is reused, otherwise only the primary key column is selected.
+
+    :param user: User instance
+    :return: primary key of the SystersUser
+    """
+    if User.systersuser.is_cached(user):
+        return user.systersuser.pk
+    return SystersUser.objects.filter(user=user).values_list('pk', flat=True).get()
+
 
 @transaction.atomic
 def create_groups(meetup):
@@ -178,6 +207,12 @@ def edit_meetup(meetup):
     json_data = json.dumps(body)
     conn.request("PATCH", "/v2/meetings/{0}".format(meetup.meeting_id),
                  headers=headers, body=json_data)
+    res = conn.getresponse()
+    data = res.read()
+    if not data:
+        return {}
+    meet_details = json.loads(data.decode("utf-8"))
+    return meet_details
 
 
 def get_meetup(meetup):
@@ -198,3 +233,37 @@ def get_meetup(meetup):
     data = res.read()
     meet_details = json.loads(data.decode("utf-8"))
     return meet_details
+
+
+def provision_zoom_meeting(meetup_pk):
+    """Create the Zoom meeting of a virtual Meetup and store its links on the Meetup row.
+    Failures are logged, since the job runs outside of any request.
+
+    :param meetup_pk: primary key of the virtual Meetup
+    """
+    meetup = Meetup.objects.get(pk=meetup_pk)
+    try:
+        _store_zoom_links(meetup_pk, create_meetup(meetup))
+    except ZOOM_ERRORS:
+        logger.exception("Could not create the Zoom meeting of Meetup %s", meetup_pk)
+
+
+def sync_zoom_meeting(meetup_pk):
+    """Push the details of an edited virtual Meetup to Zoom and store the refreshed links.
+    Failures are logged, since the job runs outside of any request.
+
+    :param meetup_pk: primary key of the virtual Meetup
+    """
+    meetup = Meetup.objects.get(pk=meetup_pk)
+    try:
+        _store_zoom_links(meetup_pk, edit_meetup(meetup) or get_meetup(meetup))
+    except ZOOM_ERRORS:
+        logger.exception("Could not update the Zoom meeting of Meetup %s", meetup_pk)
+
+
+def _store_zoom_links(meetup_pk, meet_data):
+    """Store the links of a Zoom meeting with a single UPDATE of the Meetup row. A response
+    without the links (a Zoom error payload) raises KeyError before anything is written."""
+    Meetup.objects.filter(pk=meetup_pk).update(meet_link=meet_data['join_url'],
+                                               start_url=meet_data['start_url'],
+                                               meeting_id=meet_data['id'])
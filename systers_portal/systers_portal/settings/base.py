@@ -138,6 +138,9 @@ MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
 MEDIA_URL = "/media/"
 
+# Uploads larger than 1 MB are streamed to a temporary file instead of being kept in memory
+FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024
+
 # Django-allauth settings
 # https://django-allauth.readthedocs.org/en/latest/#configuration
 ACCOUNT_EMAIL_REQUIRED = True